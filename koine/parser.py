@@ -1,24 +1,104 @@
 import re
+import sys
+import hashlib
+import string
+from array import array
 from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import json
 from dataclasses import dataclass
 from typing import Optional
 from copy import deepcopy
 from contextlib import contextmanager
-from functools import reduce
+from functools import lru_cache, partial, reduce
+from itertools import accumulate, chain
+from math import isfinite
 from operator import getitem
 from pathlib import Path
 import yaml
+try:
+    # The libyaml-backed loader is an order of magnitude faster than the
+    # pure-Python one; fall back when PyYAML was built without it.
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
 from parsimonious.grammar import Grammar
 from parsimonious.nodes import NodeVisitor
 from parsimonious.expressions import Literal, Quantifier, Lookahead, Regex, Expression
 from parsimonious.exceptions import ParseError, IncompleteParseError, LeftRecursionError, VisitationError, BadGrammar, UndefinedLabel
 
-def sanitize_to_json_data(obj): return json.loads(json.dumps(obj))
+try:
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
+def _has_non_finite(obj):
+    """True if obj contains a NaN or infinite float anywhere (dict keys
+    included, since non-string keys are serialized too). isinstance, not
+    exact-type, checks: orjson serializes dict/list subclasses like
+    OrderedDict natively, so they must be scanned too."""
+    stack = [obj]
+    while stack:
+        x = stack.pop()
+        if isinstance(x, float):
+            if not isfinite(x):
+                return True
+        elif isinstance(x, dict):
+            stack.extend(x.keys())
+            stack.extend(x.values())
+        elif isinstance(x, (list, tuple)):
+            stack.extend(x)
+    return False
+
+def sanitize_to_json_data(obj):
+    # orjson round-trips several times faster than stdlib json, but it
+    # serializes NaN/Infinity as null instead of raising, so inputs holding
+    # non-finite floats (reachable from YAML .nan/.inf) take the stdlib
+    # path, which preserves them. Datetimes are passed through rather than
+    # serialized so they raise TypeError exactly as stdlib json does
+    # (unquoted YAML date scalars would otherwise be silently stringified
+    # only when orjson happens to be installed). Anything else orjson
+    # rejects also falls back via TypeError.
+    if _orjson is not None and not _has_non_finite(obj):
+        try:
+            return _orjson.loads(_orjson.dumps(
+                obj, option=_orjson.OPT_NON_STR_KEYS | _orjson.OPT_PASSTHROUGH_DATETIME))
+        except TypeError:
+            pass
+    return json.loads(json.dumps(obj))
+
+# Process-wide cache of loaded grammar files, keyed by (path, mtime, size)
+# so an edited file is re-read. Values are the sanitized dicts; callers get
+# a deep copy because the grammar pipeline mutates what it loads.
+_YAML_CACHE = {}
+
+def _load_grammar_file(path):
+    """Loads and sanitizes a grammar YAML file, caching by path and stat."""
+    path = Path(path)
+    stat = path.stat()
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+    content = _YAML_CACHE.get(key)
+    if content is None:
+        # Binary mode hands libyaml raw bytes and skips the Python-level
+        # text decode.
+        with open(path, 'rb') as f:
+            raw = yaml.load(f, Loader=_YamlLoader) or {}
+        content = sanitize_to_json_data(raw)
+        _YAML_CACHE[key] = content
+    return deepcopy(content)
 
 def flatten(items):
     if items is None or items == []: return []
-    stack = list(reversed(items if isinstance(items, list) else [items]))
+    if not isinstance(items, list):
+        items = [items]
+    # Fast path: with at most one level of nesting (the overwhelmingly
+    # common case) a single C-level chain pass flattens everything.
+    if not any(isinstance(x, list) and any(isinstance(y, list) for y in x) for x in items):
+        return [x for x in chain.from_iterable(
+                    x if isinstance(x, list) else (x,) for x in items)
+                if x is not None and x != []]
+    stack = list(reversed(items))
     out = []
     while stack:
         x = stack.pop()
@@ -29,8 +109,24 @@ def flatten(items):
             out.append(x)
     return out
 
+def _filter_none(seq):
+    """Returns seq without None entries, reusing seq itself when there is
+    nothing to drop (the common case), so no new list is allocated."""
+    for x in seq:
+        if x is None:
+            return [y for y in seq if y is not None]
+    return seq
+
 def apply_type(text, type_name):
     if type_name == 'number':
+        # Integer-looking text skips the float round-trip, which also keeps
+        # integers beyond 2**53 exact. Forms like "1.0" or "1e3" still go
+        # through float so whole-valued ones collapse to int as before.
+        if '.' not in text and 'e' not in text and 'E' not in text:
+            try:
+                return int(text)
+            except ValueError:
+                pass  # e.g. "inf"/"nan"; handled by float below
         val = float(text)
         return int(val) if val.is_integer() else val
     if type_name == 'bool':
@@ -51,6 +147,74 @@ class Token:
     def __repr__(self):
         return f"Token({self.type}, '{self.value}', L{self.line}:C{self.col})"
 
+class TokenStream:
+    """
+    Struct-of-arrays storage for lexed tokens. Token attributes live in four
+    parallel sequences (compact int arrays for positions) instead of one
+    object per lexeme, which cuts allocation during lexing and keeps the
+    token-type list contiguous for the parser's token-string join. Indexing
+    materializes a `Token` view lazily for compatibility.
+    """
+    __slots__ = ('types', 'values', 'lines', 'cols', '_type_offsets')
+
+    def __init__(self):
+        self.types = []
+        self.values = []
+        self.lines = array('i')
+        self.cols = array('i')
+        self._type_offsets = None
+
+    def append(self, type, value, line, col):
+        self.types.append(type)
+        self.values.append(value)
+        self.lines.append(line)
+        self.cols.append(col)
+        self._type_offsets = None
+
+    def type_string_offsets(self):
+        """Start offset of each token's type within `" ".join(self.types)`,
+        computed once so repeated error reporting maps positions back to
+        token indices without rescanning."""
+        if self._type_offsets is None:
+            self._type_offsets = list(accumulate((len(t) + 1 for t in self.types), initial=0))
+        return self._type_offsets
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, idx):
+        return Token(self.types[idx], self.values[idx], self.lines[idx], self.cols[idx])
+
+    def __iter__(self):
+        return map(Token, self.types, self.values, self.lines, self.cols)
+
+@lru_cache(maxsize=1024)
+def _compile_regex(pattern: str):
+    """
+    Compiles a regex through a dedicated LRU cache. The stdlib re module's
+    internal cache is small and shared process-wide, so large grammars can
+    thrash it; this keeps the hit rate deterministic for token specs reused
+    across lexer configs.
+    """
+    return re.compile(pattern)
+
+# Preprocessed lexer specs shared across StatefulLexer instances, keyed by a
+# structural fingerprint of the lexer config.
+_LEXER_SPEC_CACHE = {}
+
+# Spec regexes that cannot take part in the combined master pattern, because
+# concatenation renumbers groups and merges flag scopes: numeric and named
+# backreferences and conditional groups would silently rebind to another
+# spec's groups, and a global inline flag like (?i) would leak onto every
+# other spec (without a re.error on older Pythons). Over-matching here is
+# harmless — it only forces the per-spec fallback loop.
+_MASTER_UNSAFE_RE = re.compile(
+    r'\\[1-9]'            # numeric backreference
+    r'|\(\?P='            # named backreference
+    r'|\(\?\('            # conditional group test
+    r'|\(\?[aiLmsux]+\)'  # global inline flags
+)
+
 class StatefulLexer:
     """
     A stateful lexer that handles tokenizing text, including indentation-based
@@ -59,38 +223,100 @@ class StatefulLexer:
     def __init__(self, lexer_config: dict, tab_width=8):
         self.token_specs = lexer_config.get('tokens', [])
         self.tab_width = tab_width
-        # Compile regexes for efficiency
-        self.compiled_specs = []
-        for spec in self.token_specs:
-            self.compiled_specs.append(
-                (re.compile(spec['regex']), spec.get('action'), spec.get('token'))
+        # Spec preprocessing (regex compilation, the master pattern, and the
+        # indentation flag) depends only on the lexer config, so it is done
+        # once per distinct config and shared across instances: parsing many
+        # files with the same grammar builds one lexer per parse.
+        cache_key = _grammar_fingerprint(lexer_config)
+        cached = _LEXER_SPEC_CACHE.get(cache_key)
+        if cached is None:
+            cached = self._compile_specs(self.token_specs)
+            _LEXER_SPEC_CACHE[cache_key] = cached
+        (self.compiled_specs, self._master_re, self._master_specs,
+         self.handles_indentation) = cached
+
+    @staticmethod
+    def _compile_specs(token_specs):
+        compiled_specs = []
+        for spec in token_specs:
+            compiled_specs.append(
+                (_compile_regex(spec['regex']), spec.get('action'), spec.get('token'))
             )
-        self.handles_indentation = any(
-            spec.get('action') == 'handle_indent' for spec in self.token_specs
+        # Combine every spec into a single master pattern of optional,
+        # zero-width lookaheads: `(?=(?P<k0>...))?(?=(?P<k1>...))?...`.
+        # One C-level match call then evaluates all specs at the current
+        # position, with each group capturing its own match independently,
+        # so longest-match semantics are preserved. Specs that are unsafe
+        # to concatenate (see _MASTER_UNSAFE_RE) and patterns that fail to
+        # compile (e.g. a group-name collision between user regexes) fall
+        # back to the per-spec loop.
+        master_re = None
+        master_specs = None
+        try:
+            if token_specs and not any(
+                _MASTER_UNSAFE_RE.search(spec['regex']) for spec in token_specs
+            ):
+                master_pattern = "".join(
+                    f'(?=(?P<k{i}>{spec["regex"]}))?' for i, spec in enumerate(token_specs)
+                )
+                master_re = re.compile(master_pattern)
+                # Flat dispatch table: integer group id paired with the
+                # (action, token_type) result, resolved once at compile time.
+                group_index = master_re.groupindex
+                master_specs = [
+                    (group_index[f'k{i}'], (spec.get('action'), spec.get('token')))
+                    for i, spec in enumerate(token_specs)
+                ]
+        except re.error:
+            master_re = None
+            master_specs = None
+        handles_indentation = any(
+            spec.get('action') == 'handle_indent' for spec in token_specs
         )
+        return compiled_specs, master_re, master_specs, handles_indentation
 
-    def tokenize(self, text: str) -> list[Token]:
+    def tokenize(self, text: str) -> TokenStream:
         # The caller is responsible for stripping any unwanted leading/trailing whitespace.
-        # Normalize Windows/Mac newlines to '\n' for consistent indentation handling.
-        text = text.replace('\r\n', '\n').replace('\r', '\n')
-        text = text.expandtabs(self.tab_width)
-        tokens = []
+        # Normalize Windows/Mac newlines to '\n' for consistent indentation
+        # handling, and expand tabs so columns are consistent. Both are
+        # full-input copies, so only pay for them when the input actually
+        # contains the characters ('in' is a C-level scan).
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        if '\t' in text:
+            text = text.expandtabs(self.tab_width)
+        tokens = TokenStream()
         indent_stack = [0]
         line_num = 1
         line_start = 0
         pos = 0
+        text_len = len(text)
+
+        # Bind the hot lookups to locals; the loop below runs once per token
+        # and the attribute/method resolution cost is measurable there.
+        master_match = self._master_re.match if self._master_re is not None else None
+        master_specs = self._master_specs if master_match else None
+        compiled_specs = self.compiled_specs
+        append_token = tokens.append
+
+        while pos < text_len:
+            best_end, best_spec = -1, None
+            if master_match is not None:
+                span = master_match(text, pos).span
+                for group_id, spec in master_specs:
+                    start, end = span(group_id)
+                    if start != -1 and end > best_end:
+                        best_end, best_spec = end, spec
+            else:
+                for regex, action, token_type in compiled_specs:
+                    match = regex.match(text, pos)
+                    if match and match.end() > best_end:
+                        best_end, best_spec = match.end(), (action, token_type)
 
-        while pos < len(text):
-            longest_match, best_spec = None, None
-            for regex, action, token_type in self.compiled_specs:
-                match = regex.match(text, pos)
-                if match and (longest_match is None or len(match.group(0)) > len(longest_match.group(0))):
-                    longest_match, best_spec = match, (action, token_type)
-
-            if longest_match:
-                value = longest_match.group(0)
+            if best_spec is not None:
+                value = text[pos:best_end]
                 action, token_type = best_spec
-                
+
                 col = pos - line_start + 1
 
                 if action == 'handle_indent':
@@ -99,25 +325,25 @@ class StatefulLexer:
                     # Detect if the next line is blank or whitespace-only. If so, do not
                     # emit INDENT/DEDENT for this newline; indentation should be decided
                     # by the next non-blank line.
-                    j = longest_match.end()
-                    while j < len(text) and text[j] in (' ', '\t'):
+                    j = best_end
+                    while j < text_len and text[j] in (' ', '\t'):
                         j += 1
-                    blank_line = (j >= len(text)) or (text[j] == '\n')
+                    blank_line = (j >= text_len) or (text[j] == '\n')
 
                     if not blank_line:
                         if indent_level > indent_stack[-1]:
                             indent_stack.append(indent_level)
-                            tokens.append(Token('INDENT', '', line_num + 1, 1))
+                            append_token('INDENT', '', line_num + 1, 1)
 
                         while indent_level < indent_stack[-1]:
                             indent_stack.pop()
-                            tokens.append(Token('DEDENT', '', line_num + 1, 1))
+                            append_token('DEDENT', '', line_num + 1, 1)
 
                         if indent_level != indent_stack[-1]:
                             raise IndentationError(f"Indentation error in input text at L{line_num+1}:C1")
                 
                 elif action != 'skip':
-                    tokens.append(Token(token_type, value, line_num, col))
+                    append_token(token_type, value, line_num, col)
                 
                 # Update line and column counters
                 newlines = value.count('\n')
@@ -125,7 +351,7 @@ class StatefulLexer:
                     line_num += newlines
                     line_start = pos + value.rfind('\n') + 1
                 
-                pos = longest_match.end()
+                pos = best_end
             else:
                 col = pos - line_start + 1
                 raise SyntaxError(f"Unexpected character in input text at L{line_num}:C{col}: '{text[pos]}'")
@@ -134,7 +360,7 @@ class StatefulLexer:
         if self.handles_indentation:
             while len(indent_stack) > 1:
                 indent_stack.pop()
-                tokens.append(Token('DEDENT', '', line_num, 1))
+                tokens.append('DEDENT', '', line_num, 1)
             
         return tokens
 
@@ -142,7 +368,26 @@ class StatefulLexer:
 # 1. GRAMMAR-TO-STRING TRANSPILER
 # ==============================================================================
 
-def transpile_rule(rule_definition, is_token_grammar=False, rule_name=None):
+# The grammar keys that define a rule's structure, hoisted to module level so
+# the transpiler does not rebuild the set on every call.
+_RULE_KEYS = frozenset({
+    'literal', 'regex', 'rule', 'choice', 'sequence',
+    'zero_or_more', 'one_or_more', 'optional', 'token',
+    'positive_lookahead', 'negative_lookahead'
+})
+_QUANTIFIER_OPS = {'zero_or_more': '*', 'one_or_more': '+', 'optional': '?'}
+_LOOKAHEAD_OPS = {'positive_lookahead': '&', 'negative_lookahead': '!'}
+# Keys that make a dict an inline rule definition: _RULE_KEYS minus 'rule'
+# (a reference is never inline). 'token' is included to allow inline token
+# defs with their own ast block.
+_INLINE_RULE_KEYS = _RULE_KEYS - {'rule'}
+# Metadata keys no grammar walker should descend into. Shared by every
+# walker so adding another non-recursable key only needs one edit. The
+# reference rewriter additionally leaves subgrammar directives alone.
+_SKIP_KEYS = frozenset({'ast', 'transpile'})
+_REF_SKIP_KEYS = _SKIP_KEYS | {'subgrammar'}
+
+def transpile_rule(rule_definition, is_token_grammar=False, rule_name=None, _cache=None):
     """Recursively transpiles a single rule dictionary into a Parsimonious grammar string component."""
     if not isinstance(rule_definition, dict):
         error_msg = f"Rule definition must be a dictionary, but got {type(rule_definition).__name__}: {rule_definition!r}"
@@ -151,11 +396,7 @@ def transpile_rule(rule_definition, is_token_grammar=False, rule_name=None):
             error_msg += f" (in rule '{user_facing_rule_name}')"
         raise ValueError(error_msg)
 
-    rule_keys = {
-        'literal', 'regex', 'rule', 'choice', 'sequence',
-        'zero_or_more', 'one_or_more', 'optional', 'token',
-        'positive_lookahead', 'negative_lookahead'
-    }
+    rule_keys = _RULE_KEYS
     # This is a Koine-specific key that should be resolved before transpilation.
     # If it's still present, it means we're in a structural-only build where
     # it acts as a placeholder that should have been replaced. We treat it as
@@ -163,58 +404,138 @@ def transpile_rule(rule_definition, is_token_grammar=False, rule_name=None):
     if 'subgrammar' in rule_definition:
         return '("")?'
 
-    found_keys = [key for key in rule_definition if key in rule_keys]
+    # Shared subtrees (the same definition object referenced from several
+    # places) transpile to the same string, so within one grammar pass an
+    # id-keyed memo lets them be emitted once. Definitions are not mutated
+    # during transpilation, which keeps identity a safe key.
+    if _cache is not None:
+        cached = _cache.get(id(rule_definition))
+        if cached is not None:
+            return cached
+
+    # C-level set intersection on the keys view instead of a per-key
+    # membership scan over every definition dict.
+    found_keys = rule_definition.keys() & rule_keys
 
     if len(found_keys) != 1:
-        raise ValueError(f"Rule must have exactly one key from {rule_keys}, found {found_keys} in {rule_definition}")
-
-    rule_type, value = found_keys[0], rule_definition[found_keys[0]]
-
-    if rule_type == 'token':
-        return value
-    elif rule_type in ['literal', 'regex'] and is_token_grammar:
-        raise ValueError(f"'{rule_type}' is not supported when a lexer is defined. Use 'token' instead.")
-    elif rule_type == 'literal':
-        escaped_value = value.replace("\\", "\\\\").replace('"', '\\"')
-        return f'"{escaped_value}"'
-    elif rule_type == 'regex':
-        # To embed a regex in a parsimonious ~r"..." string, any double quotes
-        # within the regex itself must be escaped.
-        escaped_value = value.replace('"', '\\"')
-        return f'~r"{escaped_value}"'
-    elif rule_type == 'rule':
-        # If a rule reference has its own AST config, it's not a simple alias.
-        # We must prevent Parsimonious from optimizing it away, which would
-        # cause the AST config to be ignored. We force it to be a sequence
-        # of one, which is not optimized. An 'ast' block that ONLY contains
-        # 'name' is for structuring the parent and does not count.
-        ast_config = rule_definition.get('ast', {})
-        ast_keys = list(ast_config.keys())
-        is_just_a_name = len(ast_keys) == 1 and 'name' in ast_keys
-        if 'ast' in rule_definition and not is_just_a_name:
-            return f'({value} ("")?)'
-        return value
-    elif rule_type in ['choice', 'sequence']:
-        if not value:
-            return '("")?' if rule_type == 'sequence' else (_ for _ in ()).throw(ValueError("Choice cannot be empty"))
-        parts = [transpile_rule(part, is_token_grammar, rule_name=rule_name) for part in value]
-        joiner = " / " if rule_type == 'choice' else " "
-        joined_parts = joiner.join(parts)
-        # For a sequence of one item, Parsimonious optimizes `(foo)` to just `foo`.
-        # This breaks AST construction, as the sequence rule's AST config is ignored.
-        # We add a no-op (`("")?`) to prevent this optimization.
-        if rule_type == 'sequence' and len(parts) == 1:
-            return f'({joined_parts} ("")?)'
-        return f'({joined_parts})'
-    else:  # Quantifiers and lookaheads
-        # Postfix operators
-        if rule_type in ['zero_or_more', 'one_or_more', 'optional']:
-            op_map = {'zero_or_more': '*', 'one_or_more': '+', 'optional': '?'}
-            return f"({transpile_rule(value, is_token_grammar, rule_name=rule_name)}){op_map[rule_type]}"
-        # Prefix operators
-        else:  # positive_lookahead, negative_lookahead
-            op_map = {'positive_lookahead': '&', 'negative_lookahead': '!'}
-            return f"{op_map[rule_type]}({transpile_rule(value, is_token_grammar, rule_name=rule_name)})"
+        raise ValueError(f"Rule must have exactly one key from {sorted(rule_keys)}, found {sorted(found_keys)} in {rule_definition}")
+
+    rule_type = next(iter(found_keys))
+    value = rule_definition[rule_type]
+
+    result = _TRANSPILE_HANDLERS[rule_type](value, rule_definition, is_token_grammar, rule_name, _cache)
+
+    if _cache is not None:
+        _cache[id(rule_definition)] = result
+    return result
+
+
+def _transpile_token(value, rule_definition, is_token_grammar, rule_name, cache):
+    return value
+
+def _transpile_literal(value, rule_definition, is_token_grammar, rule_name, cache):
+    if is_token_grammar:
+        raise ValueError("'literal' is not supported when a lexer is defined. Use 'token' instead.")
+    escaped_value = value.replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped_value}"'
+
+def _transpile_regex(value, rule_definition, is_token_grammar, rule_name, cache):
+    if is_token_grammar:
+        raise ValueError("'regex' is not supported when a lexer is defined. Use 'token' instead.")
+    # To embed a regex in a parsimonious ~r"..." string, any double quotes
+    # within the regex itself must be escaped.
+    escaped_value = value.replace('"', '\\"')
+    return f'~r"{escaped_value}"'
+
+def _transpile_rule_ref(value, rule_definition, is_token_grammar, rule_name, cache):
+    # If a rule reference has its own AST config, it's not a simple alias.
+    # We must prevent Parsimonious from optimizing it away, which would
+    # cause the AST config to be ignored. We force it to be a sequence
+    # of one, which is not optimized. An 'ast' block that ONLY contains
+    # 'name' is for structuring the parent and does not count.
+    ast_config = rule_definition.get('ast', {})
+    ast_keys = list(ast_config.keys())
+    is_just_a_name = len(ast_keys) == 1 and 'name' in ast_keys
+    if 'ast' in rule_definition and not is_just_a_name:
+        return f'({value} ("")?)'
+    return value
+
+def _transpile_choice(value, rule_definition, is_token_grammar, rule_name, cache):
+    if not value:
+        raise ValueError("Choice cannot be empty")
+    parts = [transpile_rule(part, is_token_grammar, rule_name=rule_name, _cache=cache) for part in value]
+    return "(" + " / ".join(parts) + ")"
+
+def _transpile_sequence(value, rule_definition, is_token_grammar, rule_name, cache):
+    if not value:
+        return '("")?'
+    parts = [transpile_rule(part, is_token_grammar, rule_name=rule_name, _cache=cache) for part in value]
+    joined_parts = " ".join(parts)
+    # For a sequence of one item, Parsimonious optimizes `(foo)` to just `foo`.
+    # This breaks AST construction, as the sequence rule's AST config is ignored.
+    # We add a no-op (`("")?`) to prevent this optimization.
+    if len(parts) == 1:
+        return f'({joined_parts} ("")?)'
+    return f'({joined_parts})'
+
+def _transpile_quantifier(value, rule_definition, is_token_grammar, rule_name, cache, op):
+    # Postfix operators
+    return f"({transpile_rule(value, is_token_grammar, rule_name=rule_name, _cache=cache)}){op}"
+
+def _transpile_lookahead(value, rule_definition, is_token_grammar, rule_name, cache, op):
+    # Prefix operators
+    return f"{op}({transpile_rule(value, is_token_grammar, rule_name=rule_name, _cache=cache)})"
+
+# One handler per rule type: a single dict lookup plus call replaces the
+# string-comparison ladder transpile_rule used to walk for every node.
+_TRANSPILE_HANDLERS = {
+    'token': _transpile_token,
+    'literal': _transpile_literal,
+    'regex': _transpile_regex,
+    'rule': _transpile_rule_ref,
+    'choice': _transpile_choice,
+    'sequence': _transpile_sequence,
+}
+_TRANSPILE_HANDLERS.update(
+    (rule_type, partial(_transpile_quantifier, op=op))
+    for rule_type, op in _QUANTIFIER_OPS.items()
+)
+_TRANSPILE_HANDLERS.update(
+    (rule_type, partial(_transpile_lookahead, op=op))
+    for rule_type, op in _LOOKAHEAD_OPS.items()
+)
+
+# Cache of compiled grammars keyed by a structural fingerprint of the
+# normalized grammar dict. Re-parsing many files with the same grammar (the
+# common case) then skips both the string transpile and Parsimonious's own
+# PEG bootstrap on every construction after the first.
+_GRAMMAR_CACHE = {}
+
+# Compiled Grammar objects keyed by a hash of the transpiled grammar string.
+_COMPILED_GRAMMAR_CACHE = {}
+
+_UNDEFINED_LABEL_RE = re.compile(r'The label "([^"]+)"')
+
+# A namespace-qualified rule reference, e.g. "Sub_rule".
+_QUALIFIED_REF_RE = re.compile(r'[A-Z][a-zA-Z0-9]*_')
+
+def clear_caches():
+    """
+    Empties the process-wide grammar, lexer-spec, YAML-file and regex
+    caches. Parsing results are unaffected; the next Parser construction
+    simply pays the full compile cost again. Mainly useful in tests and
+    long-running processes that churn through many distinct grammars.
+    """
+    _GRAMMAR_CACHE.clear()
+    _COMPILED_GRAMMAR_CACHE.clear()
+    _LEXER_SPEC_CACHE.clear()
+    _YAML_CACHE.clear()
+    _compile_regex.cache_clear()
+
+def _grammar_fingerprint(grammar_dict: dict) -> bytes:
+    """Returns a stable hash of a grammar dict's structure."""
+    canonical = json.dumps(grammar_dict, sort_keys=True, default=repr)
+    return hashlib.blake2b(canonical.encode(), digest_size=16).digest()
 
 def transpile_grammar(grammar_dict):
     """Takes a full grammar dictionary and transpiles it into a single grammar string."""
@@ -222,12 +543,40 @@ def transpile_grammar(grammar_dict):
         raise ValueError("Grammar definition must have a 'rules' key.")
     
     is_token_grammar = 'lexer' in grammar_dict
-    grammar_lines = [f"{name} = {transpile_rule(rule, is_token_grammar, rule_name=name)}" for name, rule in grammar_dict['rules'].items()]
+    # One memo per transpile pass: sub-rule definitions shared between rules
+    # are emitted once.
+    cache = {}
+    grammar_lines = [f"{name} = {transpile_rule(rule, is_token_grammar, rule_name=name, _cache=cache)}" for name, rule in grammar_dict['rules'].items()]
     
     if is_token_grammar:
         token_types = {spec['token'] for spec in grammar_dict['lexer']['tokens'] if 'token' in spec}
         token_types.update(['INDENT', 'DEDENT'])
-        for token_type in sorted(token_types):
+        # Only emit terminal rules for tokens the grammar actually references;
+        # Parsimonious would otherwise compile one regex rule per declared
+        # token, referenced or not. A declared token can be referenced via
+        # 'token' or plain 'rule' (both transpile to a bare rule reference),
+        # so collect both; the token_types intersection below drops any
+        # 'rule' values that name ordinary rules. The top-level start rule
+        # and any external entry points count as references too — either may
+        # name a token directly.
+        referenced = set(grammar_dict.get('_external_refs', []))
+        start = grammar_dict.get('start_rule')
+        if isinstance(start, str):
+            referenced.add(start)
+        stack = [grammar_dict['rules']]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                token_ref = node.get('token')
+                if isinstance(token_ref, str):
+                    referenced.add(token_ref)
+                rule_ref = node.get('rule')
+                if isinstance(rule_ref, str):
+                    referenced.add(rule_ref)
+                stack.extend(v for k, v in node.items() if k not in _SKIP_KEYS)
+            elif isinstance(node, list):
+                stack.extend(node)
+        for token_type in sorted(token_types & referenced):
             # Match the token name and consume any trailing whitespace that separates it
             grammar_lines.append(f'{token_type} = ~r"{token_type}\\s*"')
 
@@ -241,10 +590,15 @@ class LineColumnFinder:
     """A utility to find the line and column of a character offset in a text."""
     def __init__(self, text: str):
         self.text = text
+        # Scan for newlines with str.find, which runs at C speed, rather
+        # than iterating every character in Python.
         self.line_starts = [0]
-        for i, char in enumerate(text):
-            if char == '\n':
-                self.line_starts.append(i + 1)
+        find = text.find
+        idx = find('\n')
+        while idx != -1:
+            self.line_starts.append(idx + 1)
+            idx = find('\n', idx + 1)
+        self._cursor = 1  # line number of the most recent lookup
 
     def find(self, offset: int) -> tuple[int, int]:
         """Returns (line, column) for a given character offset."""
@@ -253,9 +607,24 @@ class LineColumnFinder:
         if offset > len(self.text):
             offset = len(self.text)
 
-        line_num = bisect_right(self.line_starts, offset)
+        line_starts = self.line_starts
+        # Consecutive lookups during AST building land on or just after the
+        # previous one far more often than not, so try the cached line and
+        # its successor before falling back to a binary search.
+        cursor = self._cursor
+        num_lines = len(line_starts)
+        if line_starts[cursor - 1] <= offset:
+            if cursor == num_lines or offset < line_starts[cursor]:
+                line_num = cursor
+            elif cursor + 1 == num_lines or offset < line_starts[cursor + 1]:
+                line_num = cursor + 1
+            else:
+                line_num = bisect_right(line_starts, offset)
+        else:
+            line_num = bisect_right(line_starts, offset)
+        self._cursor = line_num
         # line_num is 1-based. self.line_starts is 0-indexed.
-        col_num = offset - self.line_starts[line_num - 1] + 1
+        col_num = offset - line_starts[line_num - 1] + 1
         return line_num, col_num
 
 
@@ -275,18 +644,133 @@ def is_wrapped_leaf(rule_def):
             return True
     return False
 
+class _RuleInfo:
+    """
+    Precomputed per-rule facts for AstBuilderVisitor. generic_visit runs once
+    per parse-tree node, so the rule's ast directives and sequence layout are
+    resolved ahead of time, turning the hot path's repeated dict lookups into
+    attribute reads.
+    """
+    __slots__ = ('rule_def', 'ast_config', 'tag', 'discard', 'promote',
+                 'structure', 'is_leaf_rule', 'is_sequence', 'is_quantifier',
+                 'named_child_indices')
+
 class AstBuilderVisitor(NodeVisitor):
-    def __init__(self, grammar_dict: dict, finder: LineColumnFinder, tokens: list[Token] = None):
+    def __init__(self, grammar_dict: dict, finder: LineColumnFinder, tokens: TokenStream = None):
         self.grammar_dict = grammar_dict
         self.grammar_rules = grammar_dict['rules']
         self.finder = finder
         self.tokens = tokens
         self.token_idx = 0
         self.token_rule_names = set()
+        self._spec_ast_by_type = {}
         if self.tokens:
-            lexer_tokens = {spec['token'] for spec in grammar_dict['lexer']['tokens'] if 'token' in spec}
+            lexer_tokens = set()
+            for spec in grammar_dict['lexer']['tokens']:
+                if 'token' not in spec:
+                    continue
+                lexer_tokens.add(spec['token'])
+                # First spec wins, matching the scan order this replaces.
+                self._spec_ast_by_type.setdefault(spec['token'], spec.get('ast', {}))
             lexer_tokens.update(['INDENT', 'DEDENT'])
             self.token_rule_names = lexer_tokens
+        self._rule_info = {
+            name: self._build_rule_info(name, rule_def)
+            for name, rule_def in self.grammar_rules.items()
+        }
+        # Visitor methods resolved once per expression name; the visit
+        # driver would otherwise getattr on every parse-tree node.
+        self._method_cache = {}
+
+    def _build_rule_info(self, rule_name, rule_def):
+        info = _RuleInfo()
+        info.rule_def = rule_def
+        ast_config = rule_def.get('ast', {})
+        info.ast_config = ast_config
+        # Interned once: node tags are compared and hashed by every
+        # downstream consumer, and interning makes those pointer checks.
+        tag = ast_config.get('tag', rule_name)
+        info.tag = sys.intern(tag) if type(tag) is str else tag
+        info.discard = bool(ast_config.get('discard'))
+        info.promote = bool(ast_config.get('promote'))
+        info.structure = ast_config.get('structure')
+        info.is_leaf_rule = bool(
+            ast_config.get('leaf')
+            or (not self.tokens and ('literal' in rule_def or 'regex' in rule_def))
+            or is_wrapped_leaf(rule_def)
+        )
+        info.is_sequence = 'sequence' in rule_def
+        info.is_quantifier = (
+            'one_or_more' in rule_def or 'zero_or_more' in rule_def or 'optional' in rule_def
+        )
+
+        child_producing_parts = []
+        for part in rule_def.get('sequence', []):
+            if 'positive_lookahead' in part or 'negative_lookahead' in part:
+                continue
+
+            is_discarded = False
+            if 'ast' in part and part['ast'].get('discard'):
+                is_discarded = True
+            elif 'rule' in part:
+                # If it's a rule reference, we must look up that rule's definition.
+                ref_rule_def = self.grammar_rules.get(part['rule'], {})
+                if ref_rule_def.get('ast', {}).get('discard'):
+                    is_discarded = True
+
+            if not is_discarded:
+                child_producing_parts.append(part)
+        # Pair each named part with its ordinal among the child-producing
+        # parts, so generic_visit can index straight into its children.
+        info.named_child_indices = [
+            (i, part['ast']['name'])
+            for i, part in enumerate(child_producing_parts)
+            if 'ast' in part and 'name' in part['ast']
+        ]
+        return info
+
+    def visit(self, node):
+        """
+        Walks the parse tree iteratively in post-order instead of using
+        NodeVisitor's recursive descent. Deep parse trees (long token
+        streams, heavily nested expressions) would otherwise pay one Python
+        call frame per node and can hit the recursion limit.
+        """
+        stack = [(node, False)]
+        results = []
+        method_cache = self._method_cache
+        while stack:
+            current, expanded = stack.pop()
+            if not expanded:
+                stack.append((current, True))
+                for child in reversed(current.children):
+                    stack.append((child, False))
+                continue
+
+            num_children = len(current.children)
+            if num_children:
+                visited_children = results[-num_children:]
+                del results[-num_children:]
+            else:
+                visited_children = []
+
+            expr_name = current.expr_name
+            method = method_cache.get(expr_name)
+            if method is None:
+                method = getattr(self, 'visit_' + expr_name, self.generic_visit)
+                method_cache[expr_name] = method
+            try:
+                results.append(method(current, visited_children))
+            except (VisitationError, UndefinedLabel):
+                # Don't catch and re-wrap already-wrapped exceptions.
+                raise
+            except Exception as exc:
+                if isinstance(exc, self.unwrapped_exceptions):
+                    raise
+                # Tack on the parse tree so it's easier to see where it
+                # went wrong, matching NodeVisitor's behaviour.
+                raise VisitationError(exc, type(exc), current) from exc
+        return results[0]
 
     def get_pos(self, node, children):
         if self.tokens:
@@ -309,11 +793,7 @@ class AstBuilderVisitor(NodeVisitor):
                     )
                 self.token_idx += 1
 
-                spec_ast = {}
-                for spec in self.grammar_dict.get('lexer', {}).get('tokens', []):
-                    if spec.get('token') == token.type:
-                        spec_ast = spec.get('ast', {})
-                        break
+                spec_ast = self._spec_ast_by_type.get(token.type, {})
                 # If the token's own spec says to discard, skip it.
                 if spec_ast.get('discard'):
                     return None
@@ -339,31 +819,28 @@ class AstBuilderVisitor(NodeVisitor):
                 tag = "literal" if isinstance(node.expr, Literal) else "regex"
                 line, col = self.finder.find(node.start)
                 return {"tag": tag, "text": node.text, "line": line, "col": col} if node.text else None
-            return [c for c in visited_children if c is not None]
+            return _filter_none(visited_children)
 
-        rule_def = self.grammar_rules.get(rule_name, {})
-        ast_config = rule_def.get('ast', {})
-        if ast_config.get('discard'): return None
-        
-        children = [c for c in visited_children if c is not None]
+        info = self._rule_info[rule_name]
+        rule_def = info.rule_def
+        ast_config = info.ast_config
+        if info.discard: return None
 
-        is_leaf_rule = ast_config.get('leaf') or \
-                       (not self.tokens and ('literal' in rule_def or 'regex' in rule_def)) or \
-                       is_wrapped_leaf(rule_def)
+        children = _filter_none(visited_children)
 
-        if is_leaf_rule:
+        if info.is_leaf_rule:
             line, col = self.get_pos(node, children)
             leaf_text = node.text
             if self.tokens and children:
                 texts = [c['text'] for c in flatten(children) if isinstance(c, dict) and 'text' in c]
                 if texts:
                     leaf_text = "".join(texts)
-            base_node = {"tag": ast_config.get('tag', rule_name), "text": leaf_text, "line": line, "col": col}
+            base_node = {"tag": info.tag, "text": leaf_text, "line": line, "col": col}
             if 'type' in ast_config:
                 base_node['value'] = apply_type(leaf_text, ast_config['type'])
             return base_node
 
-        if ast_config.get('promote'):
+        if info.promote:
             if isinstance(children, list):
                 children = flatten(children)
 
@@ -375,10 +852,7 @@ class AstBuilderVisitor(NodeVisitor):
                 # This is a special case for `( expression )` style rules.
                 promoted_node = children[1]
             else:
-                is_sequence = 'sequence' in rule_def
-                is_quantifier = 'one_or_more' in rule_def or 'zero_or_more' in rule_def or 'optional' in rule_def
-
-                if is_sequence or is_quantifier:
+                if info.is_sequence or info.is_quantifier:
                     # Promoted sequences and quantifiers always result in a list of children.
                     promoted_node = children
                 elif not children:
@@ -427,18 +901,20 @@ class AstBuilderVisitor(NodeVisitor):
 
             return promoted_node
 
-        structure_config = ast_config.get('structure')
+        structure_config = info.structure
         if isinstance(structure_config, str):
             if structure_config == 'left_associative_op':
                 left = children[0]
                 if len(children) < 2:
                     return left
                 for group in children[1]:
-                    clean_group = [item for item in group if item is not None]
+                    # _filter_none returns the group itself when nothing was
+                    # discarded, so clean operator chains allocate no list
+                    # per group.
+                    clean_group = _filter_none(group)
                     if not clean_group: continue
                     op, right = clean_group[0], clean_group[1]
-                    new_node = {"tag": "binary_op", "op": op, "left": left, "right": right, "line": op['line'], "col": op['col']}
-                    left = new_node
+                    left = {"tag": "binary_op", "op": op, "left": left, "right": right, "line": op['line'], "col": op['col']}
                 return left
             elif structure_config == 'right_associative_op':
                 left = children[0]
@@ -462,8 +938,6 @@ class AstBuilderVisitor(NodeVisitor):
             # Only unwrap **when it is the single element**, otherwise keep the
             # full list so we don't accidentally drop siblings that follow.
             child_nodes = visited_children[0] if len(visited_children) == 1 and isinstance(visited_children[0], list) else visited_children
-            # A filtered view that omits placeholders such as None or empty lists.
-            filtered_nodes = [c for c in child_nodes if c not in (None, [])]
 
             for name, mapping in map_children_config.items():
                 idx = mapping['from_child']
@@ -487,41 +961,20 @@ class AstBuilderVisitor(NodeVisitor):
 
         # Default node creation
         line, col = self.get_pos(node, children)
-        base_node = {"tag": ast_config.get('tag', rule_name), "text": node.text, "line": line, "col": col}
+        base_node = {"tag": info.tag, "text": node.text, "line": line, "col": col}
         
         named_children = {}
-        sequence_def = rule_def.get('sequence', [])
-        
-        child_producing_parts = []
-        for part in sequence_def:
-            is_lookahead = 'positive_lookahead' in part or 'negative_lookahead' in part
-            if is_lookahead:
-                continue
+        # `children` is parallel to the rule's child-producing parts; the
+        # pairing of names to ordinals was precomputed per rule.
+        num_children = len(children)
+        for i, child_name in info.named_child_indices:
+            # The i-th result in `children` corresponds to the i-th non-discarded rule.
+            # If that result is a list (from a promoted rule), it's assigned as a list.
+            if i < num_children:
+                named_children[child_name] = children[i]
+            else: # Handle optional named children that didn't match
+                named_children[child_name] = []
 
-            is_discarded = False
-            if 'ast' in part and part['ast'].get('discard'):
-                is_discarded = True
-            elif 'rule' in part:
-                # If it's a rule reference, we must look up that rule's definition.
-                ref_rule_def = self.grammar_rules.get(part['rule'], {})
-                if ref_rule_def.get('ast', {}).get('discard'):
-                    is_discarded = True
-
-            if not is_discarded:
-                child_producing_parts.append(part)
-
-        # `children` is a list of the results from visiting each part of the sequence.
-        # This list is parallel to the `child_producing_parts` list.
-        for i, part in enumerate(child_producing_parts):
-            if 'ast' in part and 'name' in part['ast']:
-                child_name = part['ast']['name']
-                # The i-th result in `children` corresponds to the i-th non-discarded rule.
-                # If that result is a list (from a promoted rule), it's assigned as a list.
-                if i < len(children):
-                    named_children[child_name] = children[i]
-                else: # Handle optional named children that didn't match
-                    named_children[child_name] = []
-        
         if named_children:
              base_node['children'] = named_children
         else:
@@ -538,6 +991,35 @@ class AstBuilderVisitor(NodeVisitor):
 # ==============================================================================
 # 4. AST-TO-STRING TRANSPILER
 # ==============================================================================
+def _compile_template(template: str):
+    """
+    Parses a `{name}`-style template once and returns a callable that joins
+    the literal and substituted chunks directly, avoiding str.format's
+    re-parse of the template on every node. Returns None for templates
+    using features beyond plain named fields (format specs, conversions,
+    attribute/index access), which fall back to str.format.
+    """
+    chunks = []
+    try:
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            if spec or conversion:
+                return None
+            if field is not None and not field.isidentifier():
+                return None
+            chunks.append((literal, field))
+    except ValueError:
+        return None
+
+    def render(subs, _chunks=tuple(chunks)):
+        parts = []
+        for literal, field in _chunks:
+            if literal:
+                parts.append(literal)
+            if field is not None:
+                parts.append(subs[field])
+        return "".join(parts)
+    return render
+
 class Transpiler:
     def __init__(self, transpile_grammar: dict = None):
         if transpile_grammar is None:
@@ -547,6 +1029,15 @@ class Transpiler:
         self.indent_str = transpiler_config.get('indent', '    ')
         self.indent_level = 0
         self.state = {}
+        # Memo of leaf-node output keyed by id(node), valid for one
+        # transpile() run. Only nodes whose output cannot depend on
+        # transpiler state are cached.
+        self._memo = {}
+        # Templates compiled to join-based callables, keyed by the raw
+        # template string. Shared across transpile() runs.
+        self._template_cache = {}
+        # Dot-notation paths split once into key tuples, keyed by path string.
+        self._path_cache = {}
 
     @contextmanager
     def _indented(self, flag):
@@ -558,14 +1049,36 @@ class Transpiler:
             if flag:
                 self.indent_level -= 1
 
+    def _render_template(self, template: str, subs: dict) -> str:
+        fn = self._template_cache.get(template)
+        if fn is None:
+            fn = _compile_template(template)
+            if fn is None:
+                fn = lambda s, _t=template: _t.format(**s)
+            self._template_cache[template] = fn
+        return fn(subs)
+
+    def _split_path(self, path: str) -> tuple:
+        """
+        Splits a dot-notation path into a key tuple, cached by the final
+        path string. Paths are frequently templates re-formatted per node,
+        so caching on the resulting string catches both literal and
+        templated paths.
+        """
+        keys = self._path_cache.get(path)
+        if keys is None:
+            keys = tuple(path.split('.'))
+            self._path_cache[path] = keys
+        return keys
+
     def _get_path(self, path: str):
         try:
-            return reduce(getitem, path.split('.'), self.state)
+            return reduce(getitem, self._split_path(path), self.state)
         except (KeyError, TypeError):
             return None
 
     def _set_path(self, path: str, value):
-        keys = path.split('.')
+        keys = self._split_path(path)
         d = self.state
         for key in keys[:-1]:
             d = d.setdefault(key, {})
@@ -574,7 +1087,7 @@ class Transpiler:
     def _resolve_path_in_context(self, path: str, context: dict):
         """Resolves a dot-notation path against a context dictionary."""
         try:
-            return reduce(getitem, path.split('.'), context)
+            return reduce(getitem, self._split_path(path), context)
         except (KeyError, TypeError, AttributeError):
             return None
 
@@ -605,6 +1118,7 @@ class Transpiler:
             raise ValueError("Transpilation must start from a valid AST node.")
         self.indent_level = 0
         self.state = {}
+        self._memo = {}
         out = self._transpile_node(node)
         return out
 
@@ -614,9 +1128,23 @@ class Transpiler:
 
         if not isinstance(node, dict):
             return str(node or "")
-        
+
+        node_id = id(node)
+        cached = self._memo.get(node_id)
+        if cached is not None:
+            return cached
+
         transpile_config = self.transpile_rules.get(node.get('tag'), {})
-        
+        # A node can be memoized only when its output is a pure function of
+        # the node itself: no conditional cases, no state writes, and no
+        # children whose rendering depends on the current indent level.
+        cacheable = (
+            'cases' not in transpile_config
+            and 'state_set' not in transpile_config
+            and not node.get('children')
+            and 'op' not in node
+        )
+
         output = ""
         with self._indented(transpile_config.get('indent')):
             current_indent = self.indent_str * self.indent_level
@@ -661,7 +1189,7 @@ class Transpiler:
             
             if template is not None:
                 try:
-                    output = template.format(**subs)
+                    output = self._render_template(template, subs)
                 except KeyError as ke:
                     raise ValueError(f"Missing placeholder '{ke.args[0]}' in template for tag '{node.get('tag')}'")
             elif transpile_config.get('use') == 'value':
@@ -692,6 +1220,8 @@ class Transpiler:
                         except KeyError as ke:
                             raise ValueError(f"Missing placeholder '{ke.args[0]}' in state_set value for tag '{node.get('tag')}'")
                     self._set_path(final_key, final_value)
+            if cacheable:
+                self._memo[node_id] = output
             return output
 
 # ==============================================================================
@@ -702,6 +1232,22 @@ class Transpiler:
 # 5. PARSER CORE & IMPLEMENTATIONS
 # ==============================================================================
 
+def _has_subgrammar_directive(root) -> bool:
+    """
+    Checks a rule definition for a `subgrammar` directive with an explicit
+    stack, skipping `ast` blocks and exiting on the first hit.
+    """
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            if 'subgrammar' in node:
+                return True
+            stack.extend(v for k, v in node.items() if k not in _SKIP_KEYS)
+        elif isinstance(node, list):
+            stack.extend(node)
+    return False
+
 class _ParserCore:
     """
     A base class containing common logic for parsing, grammar compilation,
@@ -710,37 +1256,100 @@ class _ParserCore:
     def _compile_grammar_from_dict(self, grammar_dict, lint=True):
         config = {}
         config['grammar_dict'] = self._normalize_grammar(grammar_dict)
-        external_refs = config['grammar_dict'].pop('_external_refs', [])
+        # Left in place (not popped): transpile_grammar also consults
+        # _external_refs when deciding which token-terminal rules to emit.
+        external_refs = config['grammar_dict'].get('_external_refs', [])
         config['is_token_grammar'] = 'lexer' in config['grammar_dict']
         if lint:
             self._lint_grammar(config['grammar_dict'], external_refs=external_refs)
         
         if config['is_token_grammar']:
             config['lexer'] = StatefulLexer(config['grammar_dict']['lexer'])
-        
-        config['grammar_string'] = transpile_grammar(config['grammar_dict'])
-        try:
-            config['grammar'] = Grammar(config['grammar_string'])
-        except LeftRecursionError as e:
-            raise ValueError(f"Left-recursion detected in grammar. Parsimonious error: {e}") from e
-        except UndefinedLabel as e:
-            label_match = re.search(r'The label "([^"]+)"', str(e))
-            missing_rule = label_match.group(1) if label_match else "unknown"
-            raise ValueError(f"Rule '{missing_rule}' is not defined in grammar.") from e
-        except VisitationError as e:
-            # Check for circular reference, which parsimonious reports as BadGrammar
-            if isinstance(e.__cause__, BadGrammar) and "Circular Reference" in str(e.__cause__):
-                raise ValueError(f"Left-recursion detected in grammar. Parsimonious error: {e}") from e
-            
-            if isinstance(e.__cause__, KeyError):
-                missing_rule = e.__cause__.args[0]
-                raise ValueError(f"Rule '{missing_rule}' is not defined in grammar.") from e
-            
-            raise ValueError(f"Error during grammar compilation. Parsimonious error: {e}") from e
+
+        config['needs_cleanup'] = self._grammar_can_emit_internal_tags(config['grammar_dict'])
+
+        cache_key = _grammar_fingerprint(config['grammar_dict'])
+        cached = _GRAMMAR_CACHE.get(cache_key)
+        if cached is not None:
+            config['grammar_string'], config['grammar'] = cached
+        else:
+            config['grammar_string'] = transpile_grammar(config['grammar_dict'])
+            # Second-level cache keyed by the transpiled string: different
+            # grammar dicts (e.g. differing only in ast directives) can emit
+            # identical Parsimonious grammars and share the compiled object.
+            string_key = hashlib.blake2b(config['grammar_string'].encode(), digest_size=16).digest()
+            cached_grammar = _COMPILED_GRAMMAR_CACHE.get(string_key)
+            if cached_grammar is not None:
+                config['grammar'] = cached_grammar
+            else:
+                try:
+                    config['grammar'] = Grammar(config['grammar_string'])
+                except LeftRecursionError as e:
+                    raise ValueError(f"Left-recursion detected in grammar. Parsimonious error: {e}") from e
+                except UndefinedLabel as e:
+                    # The exception carries the missing label directly; fall back to
+                    # parsing the message for any parsimonious version that doesn't.
+                    label = getattr(e, 'label', None)
+                    if label is not None:
+                        missing_rule = str(label)
+                    else:
+                        label_match = _UNDEFINED_LABEL_RE.search(str(e))
+                        missing_rule = label_match.group(1) if label_match else "unknown"
+                    raise ValueError(f"Rule '{missing_rule}' is not defined in grammar.") from e
+                except VisitationError as e:
+                    # Check for circular reference, which parsimonious reports as BadGrammar
+                    if isinstance(e.__cause__, BadGrammar) and "Circular Reference" in str(e.__cause__):
+                        raise ValueError(f"Left-recursion detected in grammar. Parsimonious error: {e}") from e
+
+                    if isinstance(e.__cause__, KeyError):
+                        missing_rule = e.__cause__.args[0]
+                        raise ValueError(f"Rule '{missing_rule}' is not defined in grammar.") from e
+
+                    raise ValueError(f"Error during grammar compilation. Parsimonious error: {e}") from e
+                _COMPILED_GRAMMAR_CACHE[string_key] = config['grammar']
+            _GRAMMAR_CACHE[cache_key] = (config['grammar_string'], config['grammar'])
+
+        # Reverse map from Parsimonious expression objects back to rule
+        # names, built once here so error reporting doesn't rebuild it on
+        # every ParseError.
+        config['expression_map'] = {v: k for k, v in config['grammar'].items()}
         config['start_rule'] = config['grammar_dict'].get('start_rule', 'start')
-        
+
         return config
 
+    def _grammar_can_emit_internal_tags(self, grammar_dict):
+        """
+        True if parsing could ever produce an AST node whose tag contains
+        '__' — from a normalized anonymous rule, a user-supplied tag, or a
+        token name. Grammars without any (the common case) can skip the
+        post-parse cleanup walk entirely.
+        """
+        rules = grammar_dict.get('rules', {})
+        if any('__' in name for name in rules):
+            return True
+        stack = [rules]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                ast_config = node.get('ast')
+                if isinstance(ast_config, dict):
+                    tag = ast_config.get('tag')
+                    if isinstance(tag, str) and '__' in tag:
+                        return True
+                    structure = ast_config.get('structure')
+                    if isinstance(structure, dict):
+                        structure_tag = structure.get('tag')
+                        if isinstance(structure_tag, str) and '__' in structure_tag:
+                            return True
+                stack.extend(node.values())
+            elif isinstance(node, list):
+                stack.extend(node)
+        for spec in grammar_dict.get('lexer', {}).get('tokens', []):
+            token_name = spec.get('token')
+            if isinstance(token_name, str) and '__' in token_name:
+                return True
+        return False
+
     def _get_expected_from_error(self, error, grammar_config):
         """Builds a set of human-readable expected things from a ParseError."""
         expected_things = set()
@@ -755,11 +1364,12 @@ class _ParserCore:
         if not exprs:
             return expected_things
 
-        grammar = grammar_config['grammar']
         is_token_grammar = grammar_config.get('is_token_grammar', False)
-        
-        # Build a reverse map from Parsimonious expression objects to our rule names
-        expression_map = {v: k for k, v in grammar.items()}
+
+
+        # Reverse map from Parsimonious expression objects to our rule names,
+        # precomputed at grammar-compile time.
+        expression_map = grammar_config['expression_map']
 
         visited = set()
 
@@ -858,23 +1468,8 @@ class _ParserCore:
             if not isinstance(ast_config, dict): continue
 
             is_leaf = ast_config.get('leaf', False)
-            if is_leaf:
-                # Helper to find subgrammar directives recursively
-                def has_subgrammar_directive(node):
-                    if isinstance(node, dict):
-                        if 'subgrammar' in node:
-                            return True
-                        for key, value in node.items():
-                            if key != 'ast' and has_subgrammar_directive(value):
-                                return True
-                    elif isinstance(node, list):
-                        for item in node:
-                            if has_subgrammar_directive(item):
-                                return True
-                    return False
-                
-                if has_subgrammar_directive(rule_def):
-                    raise ValueError(f"Rule '{rule_name}' is defined as a 'leaf' node but contains a 'subgrammar' directive. These are mutually exclusive.")
+            if is_leaf and _has_subgrammar_directive(rule_def):
+                raise ValueError(f"Rule '{rule_name}' is defined as a 'leaf' node but contains a 'subgrammar' directive. These are mutually exclusive.")
 
     def _check_for_unreachable_rules(self, grammar_dict, external_refs=None):
         """
@@ -892,38 +1487,43 @@ class _ParserCore:
             return
 
         def find_references(rule_def):
-            """Recursively find all rule references in a definition."""
+            """Find all rule references in a definition with an explicit stack."""
             refs = set()
-            if isinstance(rule_def, dict):
-                if 'rule' in rule_def:
-                    refs.add(rule_def['rule'])
-                for value in rule_def.values():
-                    refs.update(find_references(value))
-            elif isinstance(rule_def, list):
-                for item in rule_def:
-                    refs.update(find_references(item))
+            stack = [rule_def]
+            while stack:
+                node = stack.pop()
+                if isinstance(node, dict):
+                    if 'rule' in node:
+                        refs.add(node['rule'])
+                    stack.extend(node.values())
+                elif isinstance(node, list):
+                    stack.extend(node)
             return refs
 
+        # Build the reference adjacency once up front; the BFS below is then
+        # a pure graph traversal instead of re-walking rule bodies per visit.
+        ref_index = {
+            name: find_references(rule_def)
+            for name, rule_def in grammar_dict['rules'].items()
+        }
+
         reachable = set()
-        queue = [start_rule] + external_refs
-        
+        queue = deque([start_rule] + external_refs)
+
         while queue:
-            current_rule = queue.pop(0)
+            current_rule = queue.popleft()
             if current_rule in reachable:
                 continue
-            
+
             reachable.add(current_rule)
-            
-            if current_rule not in grammar_dict['rules']:
+
+            if current_rule not in ref_index:
                 # This indicates a reference to a non-existent rule.
                 # Parsimonious will catch this with a better error message, so we
                 # can abort the unreachability check and let that error surface.
                 return
 
-            rule_definition = grammar_dict['rules'][current_rule]
-            references = find_references(rule_definition)
-            
-            for ref in references:
+            for ref in ref_index[current_rule]:
                 if ref not in reachable:
                     queue.append(ref)
         
@@ -1035,13 +1635,8 @@ class _ParserCore:
             if 'rule' in d:
                 return False
 
-            rule_keys = {
-                'literal', 'regex', 'choice', 'sequence', 'zero_or_more', 
-                'one_or_more', 'optional', 'positive_lookahead', 'negative_lookahead',
-                'token'            # allow inline token defs with their own ast block
-            }
             # It must contain one of the core grammar keys.
-            return any(key in d for key in rule_keys)
+            return not _INLINE_RULE_KEYS.isdisjoint(d)
 
         def walker(node, base_name, counter):
             if isinstance(node, list):
@@ -1054,6 +1649,7 @@ class _ParserCore:
                             'ast': ast_config,
                             'sequence': [item]
                         }
+                        worklist.append((new_rule_name, rules[new_rule_name]))
                         node[i] = {'rule': new_rule_name}
                     else:
                         walker(item, base_name, counter)
@@ -1066,7 +1662,7 @@ class _ParserCore:
                         node['ast'] = ast_config
 
                 for key, value in list(node.items()):
-                    if key in ['ast', 'transpile']:
+                    if key in _SKIP_KEYS:
                         continue
 
                     if is_inline_def_with_ast(value):
@@ -1077,64 +1673,60 @@ class _ParserCore:
                             'ast': ast_config,
                             'sequence': [value]
                         }
+                        worklist.append((new_rule_name, rules[new_rule_name]))
                         node[key] = {'rule': new_rule_name}
                     else:
                         walker(value, base_name, counter)
 
-        # Start walking from inside each of the top-level rule definitions
-        rules_map = new_grammar.get('rules', {})
+        # Start walking from inside each of the top-level rule definitions.
+        # The walker appends any synthetic rule it creates to the worklist,
+        # so each rule is enumerated exactly once instead of rescanning the
+        # whole rule map every round.
+        worklist = deque(rules.items())
         processed_rules = set()
 
-        while True:
-            # Find rules that haven't been processed yet.
-            # This is necessary because the walker can add new rules to the map.
-            rules_to_process = {name: rule for name, rule in rules_map.items() if name not in processed_rules}
-            if not rules_to_process:
-                break # No new rules to process, we are done.
-
-            for name, rule_def in rules_to_process.items():
-                # Use a mutable list for the counter to pass by reference
-                walker(rule_def, name, [0])
-                processed_rules.add(name)
+        while worklist:
+            name, rule_def = worklist.popleft()
+            if name in processed_rules:
+                continue
+            processed_rules.add(name)
+            # Use a mutable list for the counter to pass by reference
+            walker(rule_def, name, [0])
         return new_grammar
 
     def _cleanup_ast(self, node):
         """
-        A post-processing step to recursively remove any internal nodes (`__` in tag)
-        that may have been incorrectly generated. Returns a cleaned version of the node.
+        A post-processing step to remove any internal nodes (`__` in tag)
+        that may have been incorrectly generated. The AST was freshly built
+        by the visitor and is not shared, so it is mutated in place with a
+        single explicit-stack pass instead of rebuilding every container.
         """
-        if isinstance(node, dict):
-            # Fast-path: leaf AST node without children and not an internal tag
-            if 'tag' in node and 'children' not in node and '__' not in node.get('tag', ''):
-                return node
-        if isinstance(node, list):
-            # Build a new list containing cleaned children.
-            new_list = []
-            for item in node:
-                # If the item itself has an internal tag, filter it out.
-                if isinstance(item, dict) and '__' in item.get('tag', ''):
-                    continue
-                # Otherwise, clean the item and add it to the new list.
-                new_list.append(self._cleanup_ast(item))
-            return new_list
-
-        if isinstance(node, dict):
-            # If the node is an AST node (has a 'tag'), clean its children.
-            if 'tag' in node:
-                new_node = node.copy()
-                if 'children' in new_node:
-                    new_node['children'] = self._cleanup_ast(new_node['children'])
-                return new_node
-            # Otherwise, it's a dictionary of named children. Clean its values.
-            else:
-                new_dict = {}
-                for key, value in node.items():
-                    if isinstance(value, dict) and '__' in value.get('tag', ''):
-                        continue
-                    new_dict[key] = self._cleanup_ast(value)
-                return new_dict
-
-        # Primitive values are returned as-is.
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if isinstance(current, list):
+                # Drop items with internal tags, then clean the survivors.
+                current[:] = [
+                    item for item in current
+                    if not (isinstance(item, dict) and '__' in item.get('tag', ''))
+                ]
+                stack.extend(current)
+            elif isinstance(current, dict):
+                if 'tag' in current:
+                    # An AST node: only its children need cleaning.
+                    children = current.get('children')
+                    if children is not None:
+                        stack.append(children)
+                else:
+                    # A dictionary of named children. Drop internal values,
+                    # then clean the rest.
+                    internal_keys = [
+                        key for key, value in current.items()
+                        if isinstance(value, dict) and '__' in value.get('tag', '')
+                    ]
+                    for key in internal_keys:
+                        del current[key]
+                    stack.extend(current.values())
         return node
 
     def _parse_internal(self, text: str, grammar_config: dict, start_rule: str):
@@ -1142,19 +1734,34 @@ class _ParserCore:
         start_rule = start_rule if start_rule is not None else config['start_rule']
         finder = LineColumnFinder(text)
         tokens = None
-        
+
+        # Resolve the start rule to its parsimonious Expression once per
+        # (config, rule) pair; REPL-style workloads parse many short inputs
+        # through the same entry point.
+        expr_cache = config.setdefault('expr_cache', {})
+        start_expr = expr_cache.get(start_rule)
+        if start_expr is None:
+            try:
+                start_expr = expr_cache[start_rule] = config['grammar'][start_rule]
+            except KeyError:
+                # E.g. a declared token that no rule references — no terminal
+                # rule is emitted for it, so surface the same friendly error
+                # the compiler uses instead of a bare KeyError.
+                raise ValueError(f"Rule '{start_rule}' is not defined in grammar.") from None
+
         try:
             if config.get('is_token_grammar'):
                 tokens = config['lexer'].tokenize(text)
-                token_string = " ".join([t.type for t in tokens])
+                token_string = " ".join(tokens.types)
                 visitor = AstBuilderVisitor(config['grammar_dict'], finder, tokens)
-                tree = config['grammar'][start_rule].parse(token_string)
+                tree = start_expr.parse(token_string)
             else:
                 visitor = AstBuilderVisitor(config['grammar_dict'], finder)
-                tree = config['grammar'][start_rule].parse(text)
+                tree = start_expr.parse(text)
             
             ast = visitor.visit(tree)
-            ast = self._cleanup_ast(ast)
+            if config.get('needs_cleanup', True):
+                ast = self._cleanup_ast(ast)
             return {"status": "success", "ast": ast}
 
         except (ParseError, IncompleteParseError, SyntaxError, IndentationError) as e:
@@ -1165,12 +1772,10 @@ class _ParserCore:
                     return {"status": "error", "message": str(e)}
                 
                 error_token = None
-                
-                # Recalculate token_string as it's not available in this scope
-                token_string = " ".join([t.type for t in tokens])
-                # The number of spaces before the error position corresponds to the token index.
-                # This is more robust than splitting the string.
-                error_token_idx = token_string[:e.pos].count(' ')
+
+                # Map the error offset in the token string back to a token
+                # index with a binary search over the cached start offsets.
+                error_token_idx = bisect_right(tokens.type_string_offsets(), e.pos) - 1
                 
                 if error_token_idx < len(tokens):
                     error_token = tokens[error_token_idx]
@@ -1247,7 +1852,7 @@ class _ParserCore:
                     return
 
                 for key, value in node.items():
-                    if key in ('ast', 'transpile'): continue
+                    if key in _SKIP_KEYS: continue
                     placeholder_walker(value)
         
         placeholder_walker(node)
@@ -1266,10 +1871,7 @@ class PlaceholderParser(_ParserCore):
     @classmethod
     def from_file(cls, filepath: str):
         """Loads a grammar from a YAML file for placeholder parsing."""
-        with open(filepath, 'r') as f:
-            raw = yaml.safe_load(f) or {}
-            grammar_dict = sanitize_to_json_data(raw)
-        return cls(grammar_dict)
+        return cls(_load_grammar_file(filepath))
 
     def __init__(self, grammar_dict: dict):
         """
@@ -1320,9 +1922,7 @@ class Parser(_ParserCore):
         # subgrammars with relative paths are resolved correctly, regardless
         # of the current working directory.
         filepath_path = Path(filepath).resolve()
-        with open(filepath_path, 'r') as f:
-            raw = yaml.safe_load(f) or {}
-            grammar_dict = sanitize_to_json_data(raw)
+        grammar_dict = _load_grammar_file(filepath_path)
         # The base path for includes/subgrammars is relative to the grammar file.
         return cls(grammar_dict, base_path=filepath_path.parent)
 
@@ -1351,40 +1951,56 @@ class Parser(_ParserCore):
             # when resolving subgrammar paths.
             base_path = Path(base_path).resolve()
 
+        self._namespace_cache = {}
         unified_grammar = self._build_unified_grammar(grammar_dict, base_path)
         self.full_grammar = self._compile_grammar_from_dict(unified_grammar)
 
     def _get_namespace(self, path: Path) -> str:
+        # Memoized: this is called once per rule during reference rewriting,
+        # so recomputing the split/capitalize per call is O(rules * files).
+        cached = self._namespace_cache.get(path)
+        if cached is not None or path in self._namespace_cache:
+            return cached
         if path.name == "_.yaml":
-            return None # Main grammar has no namespace
-        stem = path.stem
-        return "".join(word.capitalize() for word in stem.replace('-', '_').split('_'))
+            namespace = None # Main grammar has no namespace
+        else:
+            stem = path.stem
+            namespace = "".join(word.capitalize() for word in stem.replace('-', '_').split('_'))
+        self._namespace_cache[path] = namespace
+        return namespace
 
     def _build_unified_grammar(self, initial_grammar_dict: dict, initial_base_path: Path) -> dict:
         # 1. Discover all grammars recursively.
         grammars = {}
         main_path_key = (initial_base_path / "_.yaml")
-        queue = [(main_path_key, initial_grammar_dict)]
+        pending = [(main_path_key, initial_grammar_dict)]
         processed_paths = set()
 
-        while queue:
-            current_path, grammar_content = queue.pop(0)
-            if current_path in processed_paths: continue
-            processed_paths.add(current_path)
-
-            grammars[current_path] = grammar_content
-            self._lint_leaf_subgrammar_conflict(grammar_content)
-            deps = self._get_subgrammar_dependencies(grammar_content.get('rules', {}))
-
-            for dep in deps:
-                sub_file = dep['subgrammar']['file']
-                # Subgrammars are resolved relative to the file they are defined in.
-                sub_path = (current_path.parent / sub_file).resolve()
-                if sub_path not in processed_paths:
-                    with open(sub_path, 'r') as f:
-                        raw = yaml.safe_load(f) or {}
-                        content = sanitize_to_json_data(raw)
-                        queue.append((sub_path, content))
+        while pending:
+            new_paths = {}  # insertion-ordered de-dup of this level's files
+            for current_path, grammar_content in pending:
+                if current_path in processed_paths: continue
+                processed_paths.add(current_path)
+
+                grammars[current_path] = grammar_content
+                self._lint_leaf_subgrammar_conflict(grammar_content)
+                deps = self._get_subgrammar_dependencies(grammar_content.get('rules', {}))
+
+                for dep in deps:
+                    sub_file = dep['subgrammar']['file']
+                    # Subgrammars are resolved relative to the file they are defined in.
+                    sub_path = (current_path.parent / sub_file).resolve()
+                    if sub_path not in processed_paths:
+                        new_paths[sub_path] = None
+
+            # Each level's files are independent, so load them concurrently:
+            # the I/O and libyaml's C parser both release the GIL.
+            if len(new_paths) > 1:
+                with ThreadPoolExecutor(max_workers=len(new_paths)) as executor:
+                    contents = list(executor.map(_load_grammar_file, new_paths))
+            else:
+                contents = [_load_grammar_file(p) for p in new_paths]
+            pending = list(zip(new_paths, contents))
         
         # Guard against duplicate namespaces across different files
         ns_to_path = {}
@@ -1414,7 +2030,10 @@ class Parser(_ParserCore):
                 unified_rules.update({k: deepcopy(v) for k, v in rules_to_add.items()})
         
         # 3. Rewrite all references now that all rules are collected.
-        rules_copy = deepcopy(unified_rules)
+        # Every value in unified_rules is already a private deepcopy made
+        # while collecting, so the rewrite passes below can mutate in place
+        # without copying the whole map again.
+        rules_copy = unified_rules
         subgrammar_entry_points = set()
         # Iterate over a copy of keys to allow modification of the dictionary during iteration.
         for rule_name in list(rules_copy.keys()):
@@ -1450,25 +2069,34 @@ class Parser(_ParserCore):
                     all_start_rules.add(start_rule)
 
         all_external_refs = subgrammar_entry_points.union(self._get_all_qualified_references(rules_copy)).union(all_start_rules)
-        final_grammar['_external_refs'] = list(all_external_refs)
+        # Sorted so the grammar dict (and thus its cache fingerprint) is
+        # deterministic across constructions.
+        final_grammar['_external_refs'] = sorted(all_external_refs)
         if 'start_rule' not in final_grammar:
              raise ValueError("The main grammar must have a 'start_rule'")
              
         return final_grammar
 
     def _rewrite_rule_references(self, node, namespace, local_rules):
-        if isinstance(node, list):
-            for i, item in enumerate(node):
-                node[i] = self._rewrite_rule_references(item, namespace, local_rules)
-        elif isinstance(node, dict):
-            if 'rule' in node:
-                ref_name = node['rule']
-                if namespace and ref_name in local_rules:
-                    node['rule'] = f"{namespace}_{ref_name}"
-
-            for key, value in node.items():
-                if key not in ['ast', 'subgrammar', 'transpile']:
-                    node[key] = self._rewrite_rule_references(value, namespace, local_rules)
+        # Pure in-place rewrite: only `rule` values change, so an iterative
+        # walker with a single type dispatch per node suffices. `ast`,
+        # `subgrammar` and `transpile` subtrees never contain rule
+        # references and are skipped outright.
+        if not namespace:
+            return node
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            t = type(n)
+            if t is list:
+                stack.extend(n)
+            elif t is dict:
+                ref_name = n.get('rule')
+                if ref_name in local_rules:
+                    n['rule'] = f"{namespace}_{ref_name}"
+                for key, value in n.items():
+                    if key not in _REF_SKIP_KEYS:
+                        stack.append(value)
         return node
 
     def _rewrite_subgrammar_directives_in_place(self, node, base_path, subgrammar_entry_points):
@@ -1484,9 +2112,7 @@ class Parser(_ParserCore):
                 sub_path = (base_path / sub_file_str).resolve()
                 sub_namespace = self._get_namespace(sub_path)
                 
-                with open(sub_path, 'r') as f:
-                    raw = yaml.safe_load(f) or {}
-                    sub_content = sanitize_to_json_data(raw)
+                sub_content = _load_grammar_file(sub_path)
 
                 start_rule = sub_config.get('rule') or sub_content.get('start_rule')
                 if not start_rule:
@@ -1495,71 +2121,73 @@ class Parser(_ParserCore):
                 qualified_start_rule = f"{sub_namespace}_{start_rule}"
                 subgrammar_entry_points.add(qualified_start_rule)
 
+                # Single-pass merge: the rule reference plus everything from
+                # the directive node except the subgrammar key itself.
                 new_rule_ref = {'rule': qualified_start_rule}
-                original_item = node.copy()
-                del original_item['subgrammar']
-                new_rule_ref.update(original_item)
+                new_rule_ref.update((k, v) for k, v in node.items() if k != 'subgrammar')
                 return new_rule_ref
             
             for key, value in node.items():
-                if key not in ['ast', 'transpile']:
+                if key not in _SKIP_KEYS:
                     replacement = self._rewrite_subgrammar_directives_in_place(value, base_path, subgrammar_entry_points)
                     if replacement is not value:
                         node[key] = replacement
         return node
 
     def _get_all_qualified_references(self, rules_to_scan: dict):
-        """Recursively finds all qualified rule references (e.g., Sub_rule)."""
+        """Finds all qualified rule references (e.g., Sub_rule)."""
         refs = set()
         visited_nodes = set()
+        stack = [rules_to_scan]
 
-        def find_refs(node):
+        while stack:
+            node = stack.pop()
             node_id = id(node)
-            if node_id in visited_nodes: return
+            if node_id in visited_nodes: continue
             visited_nodes.add(node_id)
 
             if isinstance(node, list):
-                for item in node: find_refs(item)
+                stack.extend(node)
             elif isinstance(node, dict):
                 if 'rule' in node:
                     ref_name = node['rule']
-                    if re.match(r'[A-Z][a-zA-Z0-9]*_', ref_name):
+                    # Cheap pre-filter: a qualified ref must start with an
+                    # uppercase letter and contain '_', which almost no
+                    # plain rule names do, so most skip the regex entirely.
+                    if ('_' in ref_name and ref_name[:1].isupper()
+                            and _QUALIFIED_REF_RE.match(ref_name)):
                         refs.add(ref_name)
                 for key, value in node.items():
-                    if key not in ['ast', 'transpile']:
-                        find_refs(value)
-        
-        find_refs(rules_to_scan)
+                    if key not in _SKIP_KEYS:
+                        stack.append(value)
         return refs
 
     def _get_subgrammar_dependencies(self, rules_to_scan: dict):
-        """Recursively finds all subgrammar directives in a set of rules."""
+        """Finds all subgrammar directives in a set of rules."""
         subgrammar_items = []
-        
-        # A set to keep track of nodes we've already visited to avoid infinite loops
-        # with self-referential rule structures (which are valid in Koine).
+
+        # Track visited node ids to avoid infinite loops with
+        # self-referential rule structures (which are valid in Koine).
+        # Reversed pushes keep the original depth-first discovery order.
         visited_nodes = set()
+        stack = [rules_to_scan]
 
-        def find_subgrammars(node):
-            # Use object ID to handle mutable dicts/lists correctly.
+        while stack:
+            node = stack.pop()
             node_id = id(node)
             if node_id in visited_nodes:
-                return
+                continue
             visited_nodes.add(node_id)
 
             if isinstance(node, list):
-                for item in node:
-                    find_subgrammars(item)
+                stack.extend(reversed(node))
             elif isinstance(node, dict):
                 if 'subgrammar' in node:
                     subgrammar_items.append(node)
                 else:
-                    for key, value in node.items():
-                        # Don't descend into `ast` blocks.
-                        if key not in ['ast', 'transpile']:
-                            find_subgrammars(value)
-        
-        find_subgrammars(rules_to_scan)
+                    # Don't descend into `ast` blocks.
+                    stack.extend(reversed([v for k, v in node.items()
+                                           if k not in _SKIP_KEYS]))
         return subgrammar_items
 
 
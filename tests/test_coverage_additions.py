@@ -60,3 +60,31 @@ def test_python_parser_handles_blank_line_before_indent():
     code = "def f(x):\n\n    return x"
     result = p.parse(code)
     assert result["status"] == "success"
+
+def test_lexer_backreference_spec_matches_per_spec_loop():
+    # A numeric backreference can't take part in the combined master pattern
+    # (group numbers get reassigned), so the lexer must fall back to the
+    # per-spec loop and still tokenize correctly.
+    from koine.parser import StatefulLexer
+    lexer = StatefulLexer({"tokens": [
+        {"regex": r"[0-9]+", "token": "NUM"},
+        {"regex": "(['\"]).*?\\1", "token": "STR"},
+        {"regex": r"\s+", "action": "skip"},
+    ]})
+    assert lexer._master_re is None
+    tokens = lexer.tokenize('42 "hi"')
+    assert [(t.type, t.value) for t in tokens] == [("NUM", "42"), ("STR", '"hi"')]
+
+def test_sanitize_preserves_non_finite_floats():
+    # NaN/Infinity must survive the sanitize round-trip whichever JSON
+    # backend is in use (orjson would otherwise coerce them to null).
+    import math
+    from collections import OrderedDict
+    from koine.parser import sanitize_to_json_data
+    result = sanitize_to_json_data({"a": float("nan"), "b": [float("inf"), 1.5]})
+    assert math.isnan(result["a"])
+    assert math.isinf(result["b"][0])
+    assert result["b"][1] == 1.5
+    # Dict subclasses are serialized natively by orjson and must be scanned too.
+    nested = sanitize_to_json_data(OrderedDict(x=float("-inf")))
+    assert math.isinf(nested["x"])
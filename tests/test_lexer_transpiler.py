@@ -157,6 +157,39 @@ def f(x, y):
         self.assertIn("Indentation error in input text at L3:C1", result['message'])
 
 
+    def test_token_as_start_rule(self):
+        """
+        Tests that a declared token can serve as the start rule even when no
+        rule references it: the grammar's start rule counts as a reference,
+        and a dynamic start_rule naming a token no rule uses raises the
+        friendly undefined-rule error rather than a bare KeyError.
+        """
+        grammar = {
+            'start_rule': 'NUM',
+            'lexer': {'tokens': [
+                {'regex': r'[0-9]+', 'token': 'NUM'},
+                {'regex': r'\s+', 'action': 'skip'},
+            ]},
+            'rules': {},
+        }
+        parser = Parser(grammar)
+        result = parser.parse("42")
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(result['ast']['text'], '42')
+
+        grammar_unref = {
+            'start_rule': 'start',
+            'lexer': {'tokens': [
+                {'regex': r'[a-z]+', 'token': 'WORD'},
+                {'regex': r'[0-9]+', 'token': 'NUM'},
+                {'regex': r'\s+', 'action': 'skip'},
+            ]},
+            'rules': {'start': {'token': 'WORD'}},
+        }
+        parser = Parser(grammar_unref)
+        with self.assertRaisesRegex(ValueError, "Rule 'NUM' is not defined in grammar."):
+            parser.parse("42", start_rule='NUM')
+
     def test_transpiler_state_set_with_dynamic_value(self):
         """Tests that state_set can use placeholders in its value."""
         transpiler_grammar = {
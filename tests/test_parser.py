@@ -602,6 +602,27 @@ class TestKoineGrammarGeneration(unittest.TestCase):
         with self.assertRaisesRegex(ValueError, "always produce an empty AST node.*Rules: empty_one, main"):
             Parser(grammar)
 
+    def test_placeholder_parser_skips_linting(self):
+        """
+        Tests that PlaceholderParser construction skips the linter entirely:
+        grammars that fail the unreachable-rule or empty-rule checks (common
+        in incomplete, placeholder-only files) must still compile.
+        """
+        grammar = {
+            'start_rule': 'main',
+            'rules': {
+                'main': { 'rule': 'empty_one' },
+                'empty_one': {
+                    'sequence': [ {'rule': 'discarded_a'}, {'rule': 'discarded_b'} ]
+                },
+                'discarded_a': { 'literal': 'a', 'ast': {'discard': True} },
+                'discarded_b': { 'literal': 'b', 'ast': {'discard': True} },
+                'unreachable': { 'literal': 'c' }
+            }
+        }
+        parser = PlaceholderParser(grammar)
+        self.assertEqual(parser.parse("ab")['status'], 'success')
+
     def test_regex_with_double_quotes_works(self):
         """
         Tests that a regex with a double quote works correctly, regardless